@@ -0,0 +1,57 @@
+"""Tests for the pure helpers in audio2face_unreal."""
+
+import io
+import sys
+import wave
+from pathlib import Path
+
+import pytest
+
+pytest.importorskip('numpy')
+pytest.importorskip('grpc')
+
+sys.path.insert(0, str(Path(__file__).resolve().parent))
+
+from audio2face_unreal import _parse_wav_header  # noqa: E402
+
+
+def _make_wav(channels=1, sample_rate=16000, frames=b'\x00\x01' * 100):
+    buf = io.BytesIO()
+    w = wave.open(buf, 'wb')
+    w.setnchannels(channels)
+    w.setsampwidth(2)
+    w.setframerate(sample_rate)
+    w.writeframes(frames)
+    w.close()
+    return buf.getvalue()
+
+
+def test_parse_wav_header_mono_16k():
+    data = _make_wav()
+    channels, sample_rate, bits, offset, size = _parse_wav_header(data)
+    assert (channels, sample_rate, bits) == (1, 16000, 16)
+    assert data[offset:offset + size] == b'\x00\x01' * 100
+
+
+def test_parse_wav_header_stereo_44k():
+    data = _make_wav(channels=2, sample_rate=44100)
+    channels, sample_rate, bits, _, _ = _parse_wav_header(data)
+    assert (channels, sample_rate, bits) == (2, 44100, 16)
+
+
+def test_parse_wav_header_rejects_raw_pcm():
+    # Headerless PCM like sample/sample_audio.wav starts with sample bytes.
+    with pytest.raises(ValueError, match='RIFF'):
+        _parse_wav_header(b'\xd4\xff\xe3\xff' * 16)
+
+
+def test_parse_wav_header_truncated_fmt_raises_value_error():
+    data = _make_wav()[:20]  # cut off inside the fmt chunk
+    with pytest.raises(ValueError, match='truncated'):
+        _parse_wav_header(data)
+
+
+def test_parse_wav_header_clamps_data_size_to_buffer():
+    data = _make_wav()
+    full_size = _parse_wav_header(data)[4]
+    assert _parse_wav_header(data[:-10])[4] == full_size - 10